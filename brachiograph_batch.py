@@ -0,0 +1,258 @@
+# /// script
+# requires-python = ">=3.13"
+# dependencies = [
+#   "numpy>=1.26.0",
+#   "opencv-python>=4.9.8",
+#   "Pillow>=12.1.1",
+# ]
+# ///
+
+# Headless batch conversion of images to BrachioGraph JSON, e.g.
+#
+#   uv run brachiograph_batch.py photos/ --contours 2 --hatch 16
+#   uv run brachiograph_batch.py "scans/*.png" --jobs 4 --output drawings/
+
+import argparse
+import contextlib
+import glob
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import linedraw
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".webp"}
+cache = None  # stage cache of each worker process, set up by init_worker()
+
+
+def find_images(sources):
+    images = []
+    for source in sources:
+        path = Path(source)
+        if path.is_dir():
+            candidates = sorted(path.iterdir())
+        else:
+            candidates = [Path(p) for p in sorted(glob.glob(source))]
+        images += [
+            p for p in candidates if p.is_file() and p.suffix.lower() in IMAGE_SUFFIXES
+        ]
+    # the same file matched by more than one source is only converted once
+    unique = {}
+    for image_file in images:
+        unique.setdefault(image_file.resolve(), image_file)
+    return list(unique.values())
+
+
+def clashing_names(images):
+    # images that would write the same <stem>.json and <stem>.svg into the
+    # output folder, by stem
+    by_stem = {}
+    for image_file in images:
+        by_stem.setdefault(image_file.stem, []).append(image_file)
+    return {stem: files for stem, files in by_stem.items() if len(files) > 1}
+
+
+def init_worker(output, cache_folder):
+    global cache
+    linedraw.SVG_FOLDER = output
+    linedraw.JSON_FOLDER = output
+    if cache_folder is not None:
+        cache = linedraw.StageCache(max_entries=4, directory=cache_folder)
+
+
+def convert(image_file, options, verbose):
+    # run in a worker process; the contour and hatch branches stay in this
+    # process as the pool already keeps every core busy
+    start = time.perf_counter()
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(sys.stdout if verbose else log):
+            lines = linedraw.image_to_json(
+                str(image_file), workers=1, cache=cache, **options
+            )
+    except Exception as exception:
+        return image_file, time.perf_counter() - start, None, exception, (0, 0)
+    if cache is not None:
+        hits, misses = cache.hits - hits, cache.misses - misses
+    return image_file, time.perf_counter() - start, lines, None, (hits, misses)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert images to BrachioGraph JSON and SVG files."
+    )
+    parser.add_argument(
+        "sources", nargs="+", help="image files, directories or glob patterns"
+    )
+    parser.add_argument("--resolution", type=int, default=1024)
+    parser.add_argument(
+        "--contours",
+        type=float,
+        default=2,
+        help="contour detail, smaller = more detail (0 to disable, default 2)",
+    )
+    parser.add_argument(
+        "--hatch",
+        type=float,
+        default=16,
+        help="hatch spacing, smaller = more detail (0 to disable, default 16)",
+    )
+    parser.add_argument("--repeat-contours", type=int, default=1)
+    parser.add_argument("--repeat-hatch", type=int, default=1)
+    parser.add_argument(
+        "--simplify",
+        type=float,
+        default=0,
+        help="simplify strokes, dropping points that are less than this far off "
+        "the line (default 0: keep every 8th contour point)",
+    )
+    parser.add_argument(
+        "--dedupe",
+        type=float,
+        default=0,
+        help="remove lines that retrace earlier ones to within this distance, "
+        "leaving repeats alone (default 0: off)",
+    )
+    parser.add_argument(
+        "--optimise-path",
+        action="store_true",
+        help="reorder strokes to reduce pen-up travel",
+    )
+    parser.add_argument(
+        "--two-opt-time",
+        type=float,
+        default=0,
+        help="seconds to spend refining the pen path with 2-opt",
+    )
+    parser.add_argument(
+        "--precision",
+        type=int,
+        help="write compact JSON with coordinates rounded to this many decimal places",
+    )
+    parser.add_argument(
+        "--gzip", action="store_true", help="gzip the JSON files (.json.gz)"
+    )
+    parser.add_argument(
+        "--compact-svg",
+        action="store_true",
+        help="draw all the strokes in the SVG as a single path",
+    )
+    parser.add_argument(
+        "--output",
+        default=linedraw.JSON_FOLDER,
+        help=f"folder for the JSON and SVG files (default {linedraw.JSON_FOLDER})",
+    )
+    parser.add_argument(
+        "--cache",
+        default=str(linedraw.CACHE_FOLDER),
+        help=f"folder for cached stage results (default {linedraw.CACHE_FOLDER})",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="recompute every stage")
+    parser.add_argument(
+        "--max-plot-minutes",
+        type=float,
+        help="flag drawings estimated to take longer than this to plot",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="number of images to convert at once (default: all cores)",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="show linedraw progress output"
+    )
+    args = parser.parse_args(argv)
+
+    images = find_images(args.sources)
+    if not images:
+        parser.error("no images found")
+    clashes = clashing_names(images)
+    if clashes:
+        parser.error(
+            "these images would overwrite each other's output files; rename them "
+            "or convert them in separate runs:\n"
+            + "\n".join(
+                f"    {stem}: {', '.join(str(path) for path in files)}"
+                for stem, files in clashes.items()
+            )
+        )
+
+    os.makedirs(args.output, exist_ok=True)
+    options = {
+        "resolution": args.resolution,
+        "draw_contours": args.contours,
+        "repeat_contours": args.repeat_contours,
+        "draw_hatch": args.hatch,
+        "repeat_hatch": args.repeat_hatch,
+        "simplify": args.simplify,
+        "dedupe": args.dedupe,
+        "optimise_path": args.optimise_path,
+        "two_opt_time": args.two_opt_time,
+        "json_precision": args.precision,
+        "compress_json": args.gzip,
+        "compact_svg": args.compact_svg,
+    }
+
+    print(f"Converting {len(images)} images with {args.jobs} workers...")
+    start = time.perf_counter()
+    failures = 0
+    too_long = []
+    total_strokes = 0
+    total_seconds = 0
+    total_hits = total_misses = 0
+
+    with ProcessPoolExecutor(
+        max_workers=args.jobs,
+        initializer=init_worker,
+        initargs=(args.output, None if args.no_cache else args.cache),
+    ) as executor:
+        futures = [
+            executor.submit(convert, image_file, options, args.verbose)
+            for image_file in images
+        ]
+        for future in as_completed(futures):
+            image_file, seconds, lines, exception, (hits, misses) = future.result()
+            if exception is not None:
+                failures += 1
+                print(f"{image_file}: failed after {seconds:.2f}s: {exception}")
+                continue
+            estimate = linedraw.estimate_plot(lines)
+            total_strokes += len(lines)
+            total_seconds += estimate["seconds"]
+            total_hits += hits
+            total_misses += misses
+            print(
+                f"{image_file}: {len(lines)} strokes in {seconds:.2f}s "
+                f"(cache: {hits} hits, {misses} misses)\n"
+                f"    {linedraw.format_estimate(estimate)}"
+            )
+            if (
+                args.max_plot_minutes is not None
+                and estimate["seconds"] > args.max_plot_minutes * 60
+            ):
+                too_long.append(image_file)
+
+    print(
+        f"Converted {len(images) - failures} of {len(images)} images, "
+        f"{total_strokes} strokes in total, in {time.perf_counter() - start:.2f}s"
+    )
+    print(f"Estimated plotting time for all: {total_seconds / 3600:.1f} hours")
+    if not args.no_cache:
+        print(f"Stage cache: {total_hits} hits, {total_misses} misses")
+    if too_long:
+        print(
+            f"{len(too_long)} drawings would take longer than "
+            f"{args.max_plot_minutes:g} minutes to plot:"
+        )
+        for image_file in too_long:
+            print(f"    {image_file}")
+    return 1 if failures or too_long else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,7 +3,6 @@
 # dependencies = [
 #   "PySide6>=6.7.0",
 #   "paramiko>=3.3.1",
-#   "cairosvg>=2.7.1",
 #   "numpy>=1.26.0",
 #   "opencv-python>=4.9.8",
 #   "Pillow>=12.1.1",
@@ -14,24 +13,30 @@
 # TODO: handle image sizing
 # TODO: test on Linux and Windows
 # TODO: figure out a way to handle SVG
-# TODO: other optimisations e.g. threading
 # TODO: send print instruction?
 
+import importlib
+import os
+import stat
 import sys
 import subprocess
 import json
+import threading
 from pathlib import Path
 
 from PySide6 import QtWidgets, QtGui, QtCore
 from PySide6.QtWidgets import QApplication, QMainWindow
-import paramiko
-import cairosvg
 
-from linedraw import image_to_json
+# linedraw (with numpy, Pillow and OpenCV) and uploader (with paramiko) are
+# slow to import, so they are imported where they are used and warmed up by
+# warm_up() once the window is showing
 
+# other formats are decoded at full size, so larger files are refused;
+# JPEGs are decoded at the reduced size the conversion needs, so they only
+# get a warning
 SIZE_LIMIT = 3 * 1024 * 1024  # 3 MB
+JPEG_SUFFIXES = {".jpg", ".jpeg"}
 IMAGES_DIR = Path("images")
-TEMP_DIR = Path("temp")
 DEFAULT_SETTINGS = {
     "draw_contours": 2,
     "draw_hatch": 16,
@@ -44,6 +49,73 @@ DEFAULT_SETTINGS = {
 IMAGE_EXTENSIONS = "Images (*.jpg *.jpeg *.png *.tif *.tiff *.webp)"
 JSON_EXTENSION = "JSON files (*.json)"
 CONFIG_FILE = Path.home() / ".brachiograph_converter.json"
+PREVIEW_DELAY_MS = 400  # wait for the sliders to settle before previewing
+SAVE_DELAY_MS = 1000  # gather settings changes for this long before saving
+# label -> (optimise_path, two_opt_time in seconds)
+PATH_OPTIONS = {
+    "As generated": (False, 0),
+    "Nearest neighbour": (True, 0),
+    "Nearest neighbour + 2-opt": (True, 5),
+}
+
+
+class SettingsStore(QtCore.QObject):
+    # The settings file, read once and then served from memory. Changes are
+    # written SAVE_DELAY_MS after the last one, all in one go, to a temporary
+    # file that is then renamed over the old one, so a crash mid-write can't
+    # leave it half written.
+
+    def __init__(self, path, defaults, parent=None):
+        super().__init__(parent)
+        self.path = Path(path)
+        self.settings = dict(defaults)
+        try:
+            with self.path.open("r") as config:
+                self.settings.update(json.load(config))
+        except FileNotFoundError:
+            pass
+        except ValueError as exception:
+            print(f"Ignoring unreadable settings file {self.path}: {exception}")
+        self.changed = False
+
+        self.save_timer = QtCore.QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(SAVE_DELAY_MS)
+        self.save_timer.timeout.connect(self.save)
+
+    def get(self, key, default=None):
+        return self.settings.get(key, default)
+
+    def set(self, key, value):
+        if self.settings.get(key) == value:
+            return
+        self.settings[key] = value
+        self.changed = True
+        self.save_timer.start()
+
+    def save(self):
+        self.save_timer.stop()
+        if not self.changed:
+            return
+        # the file holds the SFTP password, so it is created readable only by
+        # the user, or keeps the permissions it already had
+        try:
+            mode = stat.S_IMODE(self.path.stat().st_mode)
+        except FileNotFoundError:
+            mode = 0o600
+        temporary = self.path.with_name(f"{self.path.name}.tmp")
+        try:
+            descriptor = os.open(
+                temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+            )
+            with os.fdopen(descriptor, "w") as config:
+                os.chmod(config.fileno(), mode)
+                json.dump(self.settings, config)
+            os.replace(temporary, self.path)
+        except BaseException:
+            temporary.unlink(missing_ok=True)
+            raise
+        self.changed = False
 
 
 class SFTPSettingsDialog(QtWidgets.QDialog):
@@ -77,11 +149,156 @@ class SFTPSettingsDialog(QtWidgets.QDialog):
         self.setLayout(layout)
 
 
+def warm_up():
+    import linedraw
+
+    importlib.import_module("uploader")  # loaded now, used by the first upload
+
+    linedraw.use_opencv()
+
+
+def render_preview(lines, width, height):
+    # draw the strokes straight onto an image, scaled to fit and centred
+    from linedraw import StrokeSet
+
+    image = QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
+    image.fill(QtCore.Qt.white)
+    lines = StrokeSet.from_lines(lines)
+    if not len(lines):
+        return image
+
+    max_x, max_y = (float(v) or 1 for v in lines.points.max(axis=0))
+    scale = min((width - 1) / max_x, (height - 1) / max_y)
+    offset_x = (width - max_x * scale) / 2
+    offset_y = (height - max_y * scale) / 2
+    scaled = StrokeSet(lines.points * scale + (offset_x, offset_y), lines.offsets)
+
+    path = QtGui.QPainterPath()
+    for line in scaled:
+        line = line.tolist()
+        path.moveTo(*line[0])
+        for x, y in line[1:]:
+            path.lineTo(x, y)
+
+    painter = QtGui.QPainter(image)
+    painter.setRenderHint(QtGui.QPainter.Antialiasing)
+    painter.setPen(QtGui.QPen(QtCore.Qt.black, 1))
+    painter.drawPath(path)
+    painter.end()
+    return image
+
+
+class ConversionSignals(QtCore.QObject):
+    finished = QtCore.Signal(QtGui.QImage, str)  # the preview, plot estimate
+    failed = QtCore.Signal(str)
+    cancelled = QtCore.Signal()
+
+
+class UploadSignals(QtCore.QObject):
+    # emitted from the upload thread, delivered on the GUI thread
+    progress = QtCore.Signal(int, int)  # bytes sent, total bytes
+    finished = QtCore.Signal(object)  # the result
+    failed = QtCore.Signal(object)  # the exception
+
+
+class SyncWorker(QtCore.QRunnable):
+    # compares the folder with the device and uploads what has changed; the
+    # transfers themselves run on the upload manager's threads
+
+    def __init__(self, upload_manager, signals, *args):
+        super().__init__()
+        self.upload_manager = upload_manager
+        self.signals = signals
+        self.args = args
+
+    def run(self):
+        try:
+            synced = self.upload_manager.sync(
+                *self.args, callback=self.signals.progress.emit
+            )
+        except Exception as exception:
+            self.signals.failed.emit(exception)
+        else:
+            self.signals.finished.emit(synced)
+
+
+class ConversionWorker(QtCore.QRunnable):
+    # runs the conversion and renders the preview off the GUI thread; preview
+    # runs (write_files=False) leave the JSON and SVG files alone
+
+    def __init__(self, image_file, preview_size, cache, write_files=True, **options):
+        super().__init__()
+        self.image_file = image_file
+        self.preview_size = preview_size
+        self.cache = cache
+        self.write_files = write_files
+        self.options = options
+        self.cancel_event = threading.Event()
+        self.signals = ConversionSignals()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        from linedraw import (
+            image_to_json,
+            vectorise,
+            check_cancelled,
+            Cancelled,
+            estimate_plot,
+            format_estimate,
+        )
+
+        try:
+            if self.write_files:
+                lines = image_to_json(
+                    self.image_file,
+                    workers=1,
+                    cancel=self.cancel_event,
+                    cache=self.cache,
+                    **self.options,
+                )
+            else:
+                lines = vectorise(
+                    self.image_file,
+                    workers=1,
+                    cancel=self.cancel_event,
+                    cache=self.cache,
+                    write_svg=False,
+                    **self.options,
+                )
+            check_cancelled(self.cancel_event)
+            preview = render_preview(
+                lines, self.preview_size.width(), self.preview_size.height()
+            )
+            estimate = format_estimate(estimate_plot(lines))
+            check_cancelled(self.cancel_event)
+        except Cancelled:
+            self.signals.cancelled.emit()
+        except Exception as exception:
+            self.signals.failed.emit(str(exception))
+        else:
+            self.signals.finished.emit(preview, estimate)
+
+
 class BrachiographConverterMainWindow(QMainWindow):
 
     def __init__(self):
         super().__init__()
         self.setWindowTitle("BrachioGraph Image Converter")
+        self.conversion_worker = None
+        self.cancelled_generate = None  # a cancelled Generate yet to stop
+        self.stage_cache = None  # created by the first conversion
+        self.upload_manager = None  # created by the first upload
+        self.upload_signals = None
+
+        self.preview_timer = QtCore.QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DELAY_MS)
+        self.preview_timer.timeout.connect(self.start_preview)
+
+        # Load settings from configuration file
+        self.settings = SettingsStore(CONFIG_FILE, DEFAULT_SETTINGS, self)
 
         self.central_widget = QtWidgets.QWidget(self)
         self.setCentralWidget(self.central_widget)
@@ -93,9 +310,6 @@ class BrachiographConverterMainWindow(QMainWindow):
         QtWidgets.QApplication.setWindowIcon(app_icon)
         QtWidgets.QApplication.setApplicationName("BrachioGraph Image Converter")
 
-        # Load settings from configuration file
-        self.load_settings()
-
         # Restore window geometry and state
         self.read_settings()
 
@@ -128,8 +342,47 @@ class BrachiographConverterMainWindow(QMainWindow):
         )
         self.repeat_contours_value_label = QtWidgets.QLabel()
 
+        self.simplify_label = QtWidgets.QLabel("Simplify:")
+        self.simplify_slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.simplify_slider.setRange(0, 10)
+        self.simplify_slider.setToolTip(
+            "Drop points that are less than this far off a straight line, so curves keep their detail and straight runs need fewer points. Default is 0, which keeps every 8th contour point."
+        )
+        self.simplify_value_label = QtWidgets.QLabel()
+
+        self.optimise_path_label = QtWidgets.QLabel("Pen Path:")
+        self.optimise_path_combo = QtWidgets.QComboBox()
+        self.optimise_path_combo.addItems(PATH_OPTIONS)
+        self.optimise_path_combo.setToolTip(
+            "Reorder strokes to cut down pen-up travel. 2-opt refines the order for a few more seconds."
+        )
+
+        self.live_preview_checkbox = QtWidgets.QCheckBox("Live Preview")
+        self.live_preview_checkbox.setToolTip(
+            "Update the preview as the sliders move, without writing any files."
+        )
+        self.remove_overlaps_checkbox = QtWidgets.QCheckBox("Remove Overlaps")
+        self.remove_overlaps_checkbox.setToolTip(
+            "Skip lines that would retrace ones already drawn, e.g. where contours run along the same edge. Repeated contours are kept."
+        )
+        self.compact_json_checkbox = QtWidgets.QCheckBox("Compact JSON")
+        self.compact_json_checkbox.setToolTip(
+            "Write the JSON file without indentation and with coordinates rounded to 0.1, so it is much smaller to upload."
+        )
         self.generate_button = QtWidgets.QPushButton("Generate")
+        self.cancel_button = QtWidgets.QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setRange(0, 0)  # busy indicator
+        self.progress_bar.setTextVisible(False)
+        self.progress_bar.hide()
         self.upload_button = QtWidgets.QPushButton("Upload Files")
+        self.sync_button = QtWidgets.QPushButton("Sync Folder")
+        self.sync_button.setToolTip(
+            f"Upload the JSON files in {IMAGES_DIR}/ that are new or have changed since they were last uploaded."
+        )
+        self.upload_progress_bar = QtWidgets.QProgressBar()
+        self.upload_progress_bar.hide()
         self.quit_button = QtWidgets.QPushButton("Quit")
         self.sftp_settings_button = QtWidgets.QPushButton("SFTP Settings")
         self.view_files_button = QtWidgets.QPushButton("View Files")
@@ -140,6 +393,11 @@ class BrachiographConverterMainWindow(QMainWindow):
         )
         self.image_widget.setAlignment(QtCore.Qt.AlignCenter)
         self.image_widget.setMinimumSize(512, 512)
+        self.estimate_label = QtWidgets.QLabel()
+        self.estimate_label.setAlignment(QtCore.Qt.AlignCenter)
+        self.estimate_label.setToolTip(
+            "Estimated with BrachioGraph's default drawing area, speed and pen lift time."
+        )
 
         self.json_file_label = QtWidgets.QLabel("JSON File:")
         self.json_file_input = QtWidgets.QLineEdit()
@@ -166,12 +424,22 @@ class BrachiographConverterMainWindow(QMainWindow):
         repeat_contours_layout.addWidget(self.repeat_contours_slider, stretch=1)
         repeat_contours_layout.addWidget(self.repeat_contours_value_label)
 
+        simplify_layout = QtWidgets.QHBoxLayout()
+        simplify_layout.addWidget(self.simplify_slider, stretch=1)
+        simplify_layout.addWidget(self.simplify_value_label)
+
+        generate_layout = QtWidgets.QHBoxLayout()
+        generate_layout.addWidget(self.generate_button, stretch=1)
+        generate_layout.addWidget(self.cancel_button)
+
         json_file_layout = QtWidgets.QHBoxLayout()
         json_file_layout.addWidget(self.json_file_input, stretch=1)
         json_file_layout.addWidget(self.json_file_button)
 
         upload_button_layout = QtWidgets.QHBoxLayout()
         upload_button_layout.addWidget(self.upload_button)
+        upload_button_layout.addWidget(self.sync_button)
+        upload_button_layout.addWidget(self.upload_progress_bar, stretch=1)
 
         separator = QtWidgets.QFrame()
         separator.setFrameShape(QtWidgets.QFrame.HLine)
@@ -199,7 +467,15 @@ class BrachiographConverterMainWindow(QMainWindow):
         left_layout.addLayout(draw_hatch_layout)
         left_layout.addWidget(self.repeat_contours_label)
         left_layout.addLayout(repeat_contours_layout)
-        left_layout.addWidget(self.generate_button)
+        left_layout.addWidget(self.simplify_label)
+        left_layout.addLayout(simplify_layout)
+        left_layout.addWidget(self.optimise_path_label)
+        left_layout.addWidget(self.optimise_path_combo)
+        left_layout.addWidget(self.live_preview_checkbox)
+        left_layout.addWidget(self.remove_overlaps_checkbox)
+        left_layout.addWidget(self.compact_json_checkbox)
+        left_layout.addLayout(generate_layout)
+        left_layout.addWidget(self.progress_bar)
         left_layout.addSpacing(20)
 
         left_layout.addWidget(separator)
@@ -224,6 +500,7 @@ class BrachiographConverterMainWindow(QMainWindow):
 
         right_layout = QtWidgets.QVBoxLayout()
         right_layout.addWidget(self.image_widget)
+        right_layout.addWidget(self.estimate_label)
         right_layout.addStretch()
         self.set_picture(Path("ui") / "blank.png")
 
@@ -237,35 +514,57 @@ class BrachiographConverterMainWindow(QMainWindow):
         # Connect signals and slots
         self.content_image_button.clicked.connect(self.browse_content_image)
         self.generate_button.clicked.connect(self.generate_json)
+        self.cancel_button.clicked.connect(self.cancel_conversion)
         self.upload_button.clicked.connect(self.upload_files)
+        self.sync_button.clicked.connect(self.sync_files)
         self.quit_button.clicked.connect(self.close)
         self.draw_contours_slider.valueChanged.connect(self.update_draw_contours_value)
         self.draw_hatch_slider.valueChanged.connect(self.update_draw_hatch_value)
         self.repeat_contours_slider.valueChanged.connect(
             self.update_repeat_contours_value
         )
+        self.simplify_slider.valueChanged.connect(self.update_simplify_value)
+        for slider in (
+            self.draw_contours_slider,
+            self.draw_hatch_slider,
+            self.repeat_contours_slider,
+            self.simplify_slider,
+        ):
+            slider.valueChanged.connect(self.schedule_preview)
+        self.optimise_path_combo.currentIndexChanged.connect(self.schedule_preview)
+        self.live_preview_checkbox.toggled.connect(self.schedule_preview)
+        self.remove_overlaps_checkbox.toggled.connect(self.schedule_preview)
+        self.content_image_input.editingFinished.connect(self.schedule_preview)
         self.json_file_button.clicked.connect(self.browse_json_file)
         self.sftp_settings_button.clicked.connect(self.show_sftp_settings)
         self.view_files_button.clicked.connect(self.open_images_directory)
 
-        # Load settings from configuration file
-        self.load_settings()
+        # Start the sliders where they were left, and remember where they go
+        for name, slider in (
+            ("draw_contours", self.draw_contours_slider),
+            ("draw_hatch", self.draw_hatch_slider),
+            ("repeat_contours", self.repeat_contours_slider),
+        ):
+            slider.setValue(self.settings.get(name, DEFAULT_SETTINGS[name]))
+            slider.valueChanged.connect(
+                lambda value, name=name: self.settings.set(name, value)
+            )
 
         # Ensure labels are updated with their initial slider values
         self.update_draw_contours_value(self.draw_contours_slider.value())
         self.update_draw_hatch_value(self.draw_hatch_slider.value())
         self.update_repeat_contours_value(self.repeat_contours_slider.value())
+        self.update_simplify_value(self.simplify_slider.value())
 
     def browse_content_image(self):
-        settings = self.load_settings()
-        last_dir = settings.get("last_image_directory", str(Path.home()))
+        last_dir = self.settings.get("last_image_directory", str(Path.home()))
         file_name, _ = QtWidgets.QFileDialog.getOpenFileName(
             self, "Select Image", last_dir, IMAGE_EXTENSIONS
         )
         if file_name:
             self.content_image_input.setText(file_name)
-            settings["last_image_directory"] = str(Path(file_name).parent)
-            self.save_settings(settings)
+            self.settings.set("last_image_directory", str(Path(file_name).parent))
+            self.schedule_preview()
 
     def generate_json(self):
         print("Begin JSON generation")
@@ -280,36 +579,148 @@ class BrachiographConverterMainWindow(QMainWindow):
 
         # Check file size
         if Path(image_file).stat().st_size > SIZE_LIMIT:
-            QtWidgets.QMessageBox.warning(
+            if Path(image_file).suffix.lower() not in JPEG_SUFFIXES:
+                QtWidgets.QMessageBox.warning(
+                    self,
+                    "File Size Warning",
+                    "The selected image file is too large. Please resize it to a smaller size, or save it as a JPEG, and try again.",
+                )
+                return
+            answer = QtWidgets.QMessageBox.warning(
                 self,
                 "File Size Warning",
-                "The selected image file is too large. Please resize it to a smaller size and try again.",
+                "The selected image file is large. Convert it anyway?",
+                QtWidgets.QMessageBox.Ok | QtWidgets.QMessageBox.Cancel,
             )
-            return
+            if answer != QtWidgets.QMessageBox.Ok:
+                return
 
-        # Convert
-        image_to_json(
+        # a preview in flight is about to be superseded
+        if self.conversion_worker is not None:
+            self.cancel_conversion()
+        self.start_conversion(image_file, write_files=True)
+
+    def schedule_preview(self):
+        if not self.live_preview_checkbox.isChecked():
+            return
+        # drop a preview for settings that have already changed again, but let
+        # a Generate run finish
+        if (
+            self.conversion_worker is not None
+            and not self.conversion_worker.write_files
+        ):
+            self.cancel_conversion()
+        self.preview_timer.start()
+
+    def start_preview(self):
+        image_file = self.content_image_input.text()
+        if not image_file or not Path(image_file).is_file():
+            return
+        if (
+            Path(image_file).stat().st_size > SIZE_LIMIT
+            and Path(image_file).suffix.lower() not in JPEG_SUFFIXES
+        ):
+            return
+        if self.conversion_worker is not None:
+            # wait for the Generate run to finish
+            self.preview_timer.start()
+            return
+        self.start_conversion(image_file, write_files=False)
+
+    def start_conversion(self, image_file, write_files):
+        # Convert in the background, the preview is updated when it finishes.
+        # Stages are cached between runs, so e.g. changing the hatch spacing
+        # only recomputes the hatching.
+        optimise_path, two_opt_time = PATH_OPTIONS[
+            self.optimise_path_combo.currentText()
+        ]
+        options = {
+            "draw_contours": int(self.draw_contours_slider.value()),
+            "draw_hatch": int(self.draw_hatch_slider.value()),
+            "repeat_contours": int(self.repeat_contours_slider.value()),
+            "simplify": int(self.simplify_slider.value()),
+            "dedupe": 1 if self.remove_overlaps_checkbox.isChecked() else 0,
+            "optimise_path": optimise_path,
+            "two_opt_time": two_opt_time,
+        }
+        if write_files and self.compact_json_checkbox.isChecked():
+            options["json_precision"] = 1
+        if self.stage_cache is None:
+            from linedraw import StageCache, CACHE_FOLDER
+
+            self.stage_cache = StageCache(directory=CACHE_FOLDER)
+        worker = ConversionWorker(
             image_file,
-            draw_contours=int(self.draw_contours_slider.value()),
-            draw_hatch=int(self.draw_hatch_slider.value()),
-            repeat_contours=int(self.repeat_contours_slider.value()),
+            self.image_widget.contentsRect().size(),
+            self.stage_cache,
+            write_files,
+            **options,
+        )
+        worker.signals.finished.connect(self.conversion_finished)
+        worker.signals.failed.connect(self.conversion_failed)
+        worker.signals.cancelled.connect(self.conversion_cancelled)
+        self.set_conversion_worker(worker)
+        QtCore.QThreadPool.globalInstance().start(worker)
+
+    def cancel_conversion(self):
+        # the worker stops at its next checkpoint; until then its results are
+        # ignored, so the window is free straight away, except that Generate
+        # waits for a cancelled Generate run to stop rather than race it to
+        # write the same files
+        if self.conversion_worker is not None:
+            print("Cancelling JSON generation")
+            self.conversion_worker.cancel()
+            if self.conversion_worker.write_files:
+                self.cancelled_generate = self.conversion_worker
+        self.set_conversion_worker(None)
+
+    def release_cancelled_generate(self):
+        if (
+            self.cancelled_generate is not None
+            and self.sender() is self.cancelled_generate.signals
+        ):
+            self.cancelled_generate = None
+            self.set_conversion_worker(self.conversion_worker)
+
+    def is_current_conversion(self):
+        return (
+            self.conversion_worker is not None
+            and self.sender() is self.conversion_worker.signals
         )
 
-        # Display
-        input_svg = IMAGES_DIR / f"{Path(image_file).stem}.svg"
-        output_png = TEMP_DIR / "converted.png"
-        TEMP_DIR.mkdir(parents=True, exist_ok=True)
-
-        with input_svg.open("r") as svg_file:
-            with output_png.open("wb") as png_file:
-                cairosvg.svg2png(
-                    file_obj=svg_file,
-                    write_to=png_file,
-                    parent_width=512,
-                    parent_height=512,
-                )
+    def conversion_finished(self, preview, estimate):
+        self.release_cancelled_generate()
+        if not self.is_current_conversion():
+            return
+        self.set_conversion_worker(None)
+        self.image_widget.setPixmap(QtGui.QPixmap.fromImage(preview))
+        self.estimate_label.setText(estimate)
+
+    def conversion_failed(self, message):
+        self.release_cancelled_generate()
+        if not self.is_current_conversion():
+            return
+        write_files = self.conversion_worker.write_files
+        self.set_conversion_worker(None)
+        if not write_files:
+            print(f"Preview failed: {message}")
+            return
+        QtWidgets.QMessageBox.critical(
+            self, "Conversion Failed", f"An error occurred: {message}"
+        )
+
+    def conversion_cancelled(self):
+        self.release_cancelled_generate()
+        if self.is_current_conversion():
+            self.set_conversion_worker(None)
 
-        self.set_picture(output_png)
+    def set_conversion_worker(self, worker):
+        self.conversion_worker = worker
+        generating = worker is not None and worker.write_files
+        generating = generating or self.cancelled_generate is not None
+        self.generate_button.setEnabled(not generating)
+        self.cancel_button.setEnabled(worker is not None)
+        self.progress_bar.setVisible(worker is not None)
 
     def set_picture(self, pngfile):
         pixmap = QtGui.QPixmap(str(pngfile))
@@ -330,12 +741,42 @@ class BrachiographConverterMainWindow(QMainWindow):
         if file_name:
             self.json_file_input.setText(file_name)
 
+    def sftp_settings(self):
+        # hostname, username, password and remote directory, or None after
+        # telling the user they need setting up
+        sftp_settings = (
+            self.settings.get("sftp_hostname", ""),
+            self.settings.get("sftp_user", ""),
+            self.settings.get("sftp_password", ""),
+            self.settings.get("sftp_directory", ""),
+        )
+        if not all(sftp_settings):
+            QtWidgets.QMessageBox.critical(
+                self,
+                "SFTP Configuration Missing",
+                "Please configure the SFTP connection settings before uploading a file.\n\n"
+                "To set the configuration, click on the 'SFTP Settings' button and provide the required information.",
+            )
+            return None
+        return sftp_settings
+
+    def get_upload_manager(self):
+        # the connection is kept open, so later uploads start straight away
+        if self.upload_manager is None:
+            from uploader import UploadManager
+
+            self.upload_manager = UploadManager(workers=4)
+        return self.upload_manager
+
+    def upload_signals_for(self, finished):
+        signals = UploadSignals()
+        signals.progress.connect(self.upload_progress)
+        signals.finished.connect(finished)
+        signals.failed.connect(self.upload_failed)
+        self.upload_signals = signals
+        return signals
+
     def upload_files(self):
-        settings = self.load_settings()
-        hostname = settings.get("sftp_hostname", "")
-        username = settings.get("sftp_user", "")
-        password = settings.get("sftp_password", "")
-        remote_directory = settings.get("sftp_directory", "")
         json_file = self.json_file_input.text()
 
         if not json_file:
@@ -344,40 +785,94 @@ class BrachiographConverterMainWindow(QMainWindow):
             )
             return
 
-        if not hostname or not username or not password or not remote_directory:
-            QtWidgets.QMessageBox.critical(
-                self,
-                "SFTP Configuration Missing",
-                "Please configure the SFTP connection settings before uploading a file.\n\n"
-                "To set the configuration, click on the 'SFTP Settings' button and provide the required information.",
-            )
+        sftp_settings = self.sftp_settings()
+        if sftp_settings is None:
             return
+        hostname, username, password, remote_directory = sftp_settings
 
         print(f"Begin SFTP upload to {hostname}")
+        signals = self.upload_signals_for(self.upload_finished)
 
-        try:
-            with paramiko.Transport((hostname, 22)) as transport:
-                transport.connect(username=username, password=password)
-                with paramiko.SFTPClient.from_transport(transport) as sftp_client:
-                    print("Connection successfully established...")
+        def done(future):
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                signals.failed.emit(future.exception())
+            else:
+                signals.finished.emit(future.result())
+
+        remote_file_path = Path(remote_directory) / Path(json_file).name
+        future = self.get_upload_manager().upload(
+            hostname,
+            username,
+            password,
+            json_file,
+            remote_file_path.as_posix(),
+            callback=signals.progress.emit,
+            preserve_mtime=True,  # so that Sync Folder sees it as up to date
+        )
+        future.add_done_callback(done)
+        self.set_uploading(True)
 
-                    remote_file_path = Path(remote_directory) / Path(json_file).name
-                    sftp_client.put(json_file, str(remote_file_path))
+    def upload_progress(self, sent, total):
+        self.upload_progress_bar.setRange(0, max(total, 1))
+        self.upload_progress_bar.setValue(sent)
 
-            QtWidgets.QMessageBox.information(
-                self, "Upload Completed", "File uploaded successfully."
-            )
-        except paramiko.AuthenticationException:
+    def sync_files(self):
+        sftp_settings = self.sftp_settings()
+        if sftp_settings is None:
+            return
+        hostname, username, password, remote_directory = sftp_settings
+
+        print(f"Begin SFTP sync of {IMAGES_DIR} to {hostname}")
+        IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+        worker = SyncWorker(
+            self.get_upload_manager(),
+            self.upload_signals_for(self.sync_finished),
+            hostname,
+            username,
+            password,
+            IMAGES_DIR,
+            remote_directory,
+        )
+        self.set_uploading(True)
+        QtCore.QThreadPool.globalInstance().start(worker)
+
+    def upload_finished(self, result):
+        self.set_uploading(False)
+        QtWidgets.QMessageBox.information(
+            self, "Upload Completed", "File uploaded successfully."
+        )
+
+    def sync_finished(self, synced):
+        self.set_uploading(False)
+        if synced:
+            message = f"Uploaded {len(synced)} new or changed files."
+        else:
+            message = "Everything is already up to date."
+        QtWidgets.QMessageBox.information(self, "Sync Completed", message)
+
+    def upload_failed(self, exception):
+        import paramiko
+
+        self.set_uploading(False)
+        if isinstance(exception, paramiko.AuthenticationException):
             QtWidgets.QMessageBox.critical(
                 self,
                 "Authentication Error",
                 "Authentication failed. Please check your credentials.",
             )
-        except Exception as exception:
+        else:
             QtWidgets.QMessageBox.critical(
                 self, "Error", f"An error occurred: {exception}"
             )
 
+    def set_uploading(self, uploading):
+        self.upload_button.setEnabled(not uploading)
+        self.sync_button.setEnabled(not uploading)
+        self.upload_progress_bar.setValue(0)
+        self.upload_progress_bar.setVisible(uploading)
+
     def open_images_directory(self):
         IMAGES_DIR.mkdir(parents=True, exist_ok=True)
         print(f"Opening directory: {IMAGES_DIR}")
@@ -401,45 +896,32 @@ class BrachiographConverterMainWindow(QMainWindow):
     def update_repeat_contours_value(self, value):
         self.repeat_contours_value_label.setText(f"{value}")
 
+    def update_simplify_value(self, value):
+        self.simplify_value_label.setText(f"{value}")
+
     def show_sftp_settings(self):
         settings_dialog = SFTPSettingsDialog(self)
-        settings = self.load_settings()
-        settings_dialog.sftp_hostname_input.setText(settings.get("sftp_hostname", ""))
-        settings_dialog.sftp_user_input.setText(settings.get("sftp_user", ""))
-        settings_dialog.sftp_password_input.setText(settings.get("sftp_password", ""))
-        settings_dialog.sftp_directory_input.setText(settings.get("sftp_directory", ""))
+        inputs = {
+            "sftp_hostname": settings_dialog.sftp_hostname_input,
+            "sftp_user": settings_dialog.sftp_user_input,
+            "sftp_password": settings_dialog.sftp_password_input,
+            "sftp_directory": settings_dialog.sftp_directory_input,
+        }
+        for name, line_edit in inputs.items():
+            line_edit.setText(self.settings.get(name, ""))
 
         if settings_dialog.exec() == QtWidgets.QDialog.Accepted:
-            settings["sftp_hostname"] = settings_dialog.sftp_hostname_input.text()
-            settings["sftp_user"] = settings_dialog.sftp_user_input.text()
-            settings["sftp_password"] = settings_dialog.sftp_password_input.text()
-            settings["sftp_directory"] = settings_dialog.sftp_directory_input.text()
-            self.save_settings(settings)
-
-    def load_settings(self):
-        config_file = CONFIG_FILE
-
-        try:
-            with config_file.open("r") as config:
-                settings = json.load(config)
-        except FileNotFoundError:
-            settings = DEFAULT_SETTINGS.copy()
-            self.save_settings(settings)
-
-        self.draw_contours_slider.setValue(settings.get("draw_contours", 2))
-        self.draw_hatch_slider.setValue(settings.get("draw_hatch", 16))
-        self.repeat_contours_slider.setValue(settings.get("repeat_contours", 0))
-
-        return settings
-
-    def save_settings(self, settings):
-        config_file = CONFIG_FILE
-
-        with open(config_file, "w") as config:
-            json.dump(settings, config)
+            for name, line_edit in inputs.items():
+                self.settings.set(name, line_edit.text())
+            self.settings.save()
 
     def closeEvent(self, event):
+        # a conversion in progress stops at its next checkpoint
+        self.cancel_conversion()
         self.write_settings()
+        self.settings.save()
+        if self.upload_manager is not None:
+            self.upload_manager.close()
         super().closeEvent(event)
 
     def read_settings(self):
@@ -461,4 +943,7 @@ if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = BrachiographConverterMainWindow()
     window.show()
+    QtCore.QTimer.singleShot(
+        0, lambda: threading.Thread(target=warm_up, daemon=True).start()
+    )
     sys.exit(app.exec())
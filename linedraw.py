@@ -4,31 +4,151 @@
 # by Lingdong Huang
 # and from Daniele Procida's modifications for BrachioGraph
 
+import io
 import os
 import json
+import gzip
+import pickle
+import hashlib
 import time
 import math
+import threading
+from bisect import bisect_left
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from PIL import Image, ImageOps
 
 # constants
 EXPORT_PATH = "images/out.svg"
 SVG_FOLDER = "images/"
 JSON_FOLDER = "images/"
+CACHE_FOLDER = Path.home() / ".cache" / "brachiograph_converter"
 NO_CV_MODE = False
-
-# Ensure directories exist
-os.makedirs(SVG_FOLDER, exist_ok=True)
-os.makedirs(JSON_FOLDER, exist_ok=True)
-
-try:
-    import numpy as np
-    import cv2
-except ImportError as import_error:
-    print(f"ImportError: {import_error}")
-    print("Unable to import numpy/openCV. Switching to NO_CV mode.")
-    NO_CV_MODE = True
+HATCH_ENGINE = "numpy"  # set to "python" to check against the original loop
+# for estimate_plot(), BrachioGraph's defaults: the drawing area in cm, pen
+# speed (0.1 cm steps every 0.01 s) and time for the pen to go up or down
+PLOT_BOUNDS = (-8, 4, 6, 13)
+PLOT_SPEED = 10
+PEN_LIFT_SECONDS = 0.25
+
+cv2 = None  # imported by use_opencv() when edges are first needed
+branch_pools = {}  # process pools for vectorise(workers=n), by n
+
+
+# -------------- stroke storage --------------
+
+
+class StrokeSet:
+    # A list of strokes kept as one (n, 2) float64 array of points, plus the
+    # index where each stroke starts (offsets has one more entry than there
+    # are strokes; the last is the total number of points). Indexing with an
+    # int gives a view of that stroke's points, slicing gives a StrokeSet, and
+    # + and * concatenate and repeat like lists do.
+
+    def __init__(self, points=None, offsets=None):
+        if points is None:
+            points = np.zeros((0, 2))
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if offsets is None:
+            offsets = [0, len(self.points)] if len(self.points) else [0]
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_lines(cls, lines):
+        if isinstance(lines, cls):
+            return lines
+        lines = [line for line in lines if len(line)]
+        lengths = [len(line) for line in lines]
+        points = [point for line in lines for point in line]
+        return cls(points, np.concatenate(([0], np.cumsum(lengths))))
+
+    @classmethod
+    def from_segments(cls, starts, ends):
+        # two-point strokes from matching (n, 2) arrays of start and end points
+        points = np.stack((starts, ends), axis=1).reshape(-1, 2)
+        return cls(points, np.arange(0, len(points) + 1, 2))
+
+    @classmethod
+    def concatenate(cls, stroke_sets):
+        stroke_sets = [cls.from_lines(lines) for lines in stroke_sets]
+        if not stroke_sets:
+            return cls()
+        points = np.concatenate([lines.points for lines in stroke_sets])
+        lengths = np.concatenate([lines.lengths for lines in stroke_sets])
+        return cls(points, np.concatenate(([0], np.cumsum(lengths))))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return self.take(range(start, stop, step))
+            stop = max(start, stop)
+            offsets = self.offsets[start : stop + 1]
+            return StrokeSet(
+                self.points[offsets[0] : offsets[-1]], offsets - offsets[0]
+            )
+        if not isinstance(index, (int, np.integer)):
+            # an array of indices, or a boolean mask
+            index = np.arange(len(self))[index]
+            return self.take(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("stroke index out of range")
+        return self.points[self.offsets[index] : self.offsets[index + 1]]
+
+    def __iter__(self):
+        for start, stop in zip(self.offsets[:-1], self.offsets[1:]):
+            yield self.points[start:stop]
+
+    def __add__(self, other):
+        return StrokeSet.concatenate([self, other])
+
+    def __radd__(self, other):
+        return StrokeSet.concatenate([other, self])
+
+    def __mul__(self, times):
+        return self.take(np.tile(np.arange(len(self)), max(times, 0)))
+
+    __rmul__ = __mul__
+
+    def __repr__(self):
+        return f"<StrokeSet: {len(self)} strokes, {len(self.points)} points>"
+
+    @property
+    def lengths(self):
+        # number of points in each stroke
+        return np.diff(self.offsets)
+
+    @property
+    def starts(self):
+        return self.points[self.offsets[:-1]]
+
+    @property
+    def ends(self):
+        return self.points[self.offsets[1:] - 1]
+
+    def take(self, order, reverse=None):
+        # the strokes in the given order, reversing those flagged in reverse
+        order = np.asarray(order, dtype=np.int64)
+        lengths = self.lengths[order]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        step = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths)
+        first = np.repeat(self.offsets[order], lengths)
+        if reverse is not None:
+            reverse = np.repeat(np.asarray(reverse, dtype=bool), lengths)
+            step = np.where(reverse, np.repeat(lengths, lengths) - 1 - step, step)
+        return StrokeSet(self.points[first + step], offsets)
+
+    def tolist(self):
+        points = plain_numbers(self.points)
+        offsets = self.offsets.tolist()
+        return [points[start:stop] for start, stop in zip(offsets, offsets[1:])]
 
 
 # -------------- output functions --------------
@@ -41,6 +161,16 @@ def image_to_json(
     repeat_contours=1,
     draw_hatch=False,
     repeat_hatch=1,
+    optimise_path=False,
+    two_opt_time=0,
+    workers=1,
+    cancel=None,
+    cache=None,
+    json_precision=None,
+    compress_json=False,
+    compact_svg=False,
+    simplify=0,
+    dedupe=0,
 ):
 
     lines = vectorise(
@@ -50,26 +180,79 @@ def image_to_json(
         repeat_contours,
         draw_hatch,
         repeat_hatch,
+        optimise_path,
+        two_opt_time,
+        workers,
+        cancel,
+        cache,
+        compact_svg=compact_svg,
+        simplify=simplify,
+        dedupe=dedupe,
     )
 
     pure_filename = Path(image_filename).stem
 
-    filename = filename = Path(JSON_FOLDER) / f"{pure_filename}.json"
-    lines_to_file(lines, filename)
+    suffix = ".json.gz" if compress_json else ".json"
+    os.makedirs(JSON_FOLDER, exist_ok=True)
+    filename = Path(JSON_FOLDER) / f"{pure_filename}{suffix}"
+    check_cancelled(cancel)
+    lines_to_file(lines, filename, json_precision)
+    return lines
+
+
+def make_svg(lines, compact=False):
+    out = io.StringIO()
+    write_svg_to(lines, out, compact)
+    return out.getvalue()
 
 
-def make_svg(lines):
+def svg_to_file(lines, filename, compact=False):
+    with open(filename, "w") as file_to_save:
+        write_svg_to(lines, file_to_save, compact)
+
+
+def write_svg_to(lines, out, compact=False, chunk_size=2000):
+    # Writes the SVG to the file-like out, formatting chunk_size strokes at a
+    # time. Each stroke is a <polyline>, or with compact=True all the strokes
+    # go into a single <path> with coordinates rounded to 0.01.
     print("Generating SVG file...")
-    width = math.ceil(max([max([p[0] * 0.5 for p in l]) for l in lines]))
-    height = math.ceil(max([max([p[1] * 0.5 for p in l]) for l in lines]))
-    out = f'<svg xmlns="http://www.w3.org/2000/svg" height="{height}px" width="{width}px" version="1.1">'
-    out += "".join(
-        f'<polyline points="{",".join(f"{p[0] * 0.5},{p[1] * 0.5}" for p in l)}" '
-        'stroke="black" stroke-width="1" fill="none" />\n'
-        for l in lines
+    lines = StrokeSet.from_lines(lines)
+    if len(lines.points):
+        width, height = (math.ceil(v) for v in lines.points.max(axis=0) * 0.5)
+    else:
+        width = height = 0
+    out.write(
+        f'<svg xmlns="http://www.w3.org/2000/svg" height="{height}px" width="{width}px" version="1.1">'
     )
-    out += "</svg>"
-    return out
+    if compact:
+        out.write('<path d="')
+    for first in range(0, len(lines), chunk_size):
+        chunk = lines[first : first + chunk_size]
+        points = chunk.points * 0.5
+        if compact:
+            points = points.round(2)
+            pairs = [f"{x:g},{y:g}" for x, y in points.tolist()]
+        else:
+            pairs = [f"{x},{y}" for x, y in points.tolist()]
+        offsets = chunk.offsets.tolist()
+        if compact:
+            out.write(
+                "".join(
+                    f"M{pairs[start]} {' '.join(pairs[start + 1 : stop])}"
+                    for start, stop in zip(offsets, offsets[1:])
+                )
+            )
+        else:
+            out.write(
+                "".join(
+                    f'<polyline points="{",".join(pairs[start:stop])}" '
+                    'stroke="black" stroke-width="1" fill="none" />\n'
+                    for start, stop in zip(offsets, offsets[1:])
+                )
+            )
+    if compact:
+        out.write('" stroke="black" stroke-width="1" fill="none" />\n')
+    out.write("</svg>")
 
 
 # use turtle graphics to visualise how a set of lines will be drawn
@@ -129,6 +312,36 @@ def resize_image(image, resolution, draw_option, h, w):
     )
 
 
+def decode_factor(w, resolution, draw_option):
+    # the largest power of two the image can be shrunk by while staying wider
+    # than the stage with this option will ask for
+    needed = resolution / draw_option
+    factor = 1
+    while w / (factor * 2) >= needed:
+        factor *= 2
+    return factor
+
+
+def load_greyscale(image, factor):
+    # Decode at 1/factor of the full size, straight to greyscale where the
+    # format allows it (JPEG can scale down by up to 8 while decoding), and
+    # shrink whatever is left with reduce().
+    w, h = image.size
+    if factor > 1:
+        image.draft("L", (w // factor, h // factor))
+    rest = max(1, int(image.width * factor / w))
+
+    grey = image.convert("L")
+    image.close()
+    return shrink_greyscale(grey, rest)
+
+
+def shrink_greyscale(grey, factor):
+    if factor > 1:
+        grey = grey.reduce(factor)
+    return ImageOps.autocontrast(grey, 10)
+
+
 def vectorise(
     image_filename,
     resolution=1024,
@@ -136,6 +349,15 @@ def vectorise(
     repeat_contours=1,
     draw_hatch=False,
     repeat_hatch=1,
+    optimise_path=False,
+    two_opt_time=0,
+    workers=1,
+    cancel=None,
+    cache=None,
+    write_svg=True,
+    compact_svg=False,
+    simplify=0,
+    dedupe=0,
 ):
 
     image = None
@@ -159,38 +381,240 @@ def vectorise(
     else:
         raise FileNotFoundError(f"Image file not found: {image_filename}")
 
+    # stage results are cached against the file contents and the parameters
+    # they depend on, so e.g. changing the hatch spacing reuses the contours
+    image_key = file_hash(p)
+    cache = cache if cache is not None else StageCache(0)
+
     w, h = image.size
+    reduced_decode = image.format == "JPEG"
+    image.close()
+
+    # With simplify, contours keep all their points for simplify_lines() to
+    # thin out, rather than every 8th. A branch repeated 0 times would not be
+    # drawn, so it isn't worked out either (nor left to trim the others in
+    # remove_overlaps()). OpenCV's Canny and the Sobel filter used without
+    # it find different edges, so contours are cached against the one that
+    # made them.
+    branches = []
+    edge_engine = None
+    if draw_contours and repeat_contours > 0:
+        decimate = 1 if simplify else 8
+        branches.append((get_contours, (draw_contours, decimate), repeat_contours))
+        edge_engine = "opencv" if use_opencv() else "sobel"
+    if draw_hatch and repeat_hatch > 0:
+        branches.append((hatch, (draw_hatch,), repeat_hatch))
+
+    # each branch gets the image at the size its own option needs, so that
+    # its result depends only on its own settings: JPEGs are decoded at that
+    # size, other formats are decoded once at full size and then reduced
+    results = {}
+    pending = []
+    full_size = None
+    for function, options, repeat in branches:
+        key = (function.__name__, image_key, resolution, *options)
+        if function is get_contours:
+            key += (edge_engine,)
+        results[function] = cache.get(key)
+        if results[function] is None:
+            factor = decode_factor(w, resolution, options[0])
+            image = cache.get(("image", image_key, factor))
+            if image is None:
+                if reduced_decode:
+                    image = load_greyscale(Image.open(p), factor)
+                else:
+                    if full_size is None:
+                        with Image.open(p) as source:
+                            full_size = source.convert("L")
+                    image = shrink_greyscale(full_size, factor)
+                cache.put(("image", image_key, factor), image)
+            check_cancelled(cancel)
+            image_resized = resize_image(image, resolution, options[0], h, w)
+            pending.append((function, image_resized, options, key))
+
+    # contours and hatching are independent, and can be run side by side in
+    # separate processes with workers > 1; both are mostly vectorised, so
+    # that rarely pays for starting the pool, which is then kept for reuse
+    if workers > 1 and len(pending) > 1:
+        executor = branch_executor(workers)
+        futures = {
+            function: executor.submit(function, image_resized, *options)
+            for function, image_resized, options, key in pending
+        }
+        for function, future in futures.items():
+            results[function] = future.result()
+    else:
+        for function, image_resized, options, key in pending:
+            results[function] = function(image_resized, *options)
 
-    # one-shot convert image to greyscale and max contrast
-    image = ImageOps.autocontrast(image.convert("L"), 10)
-    lines = []
+    for function, image_resized, options, key in pending:
+        cache.put(key, results[function])
 
-    with ThreadPoolExecutor() as executor:
-        if draw_contours:
-            image_resized = resize_image(image, resolution, draw_contours, h, w)
-            contours = executor.submit(
-                get_contours, image_resized, draw_contours
-            ).result()
-            lines += contours * repeat_contours
-
-        if draw_hatch:
-            image_resized = resize_image(image, resolution, draw_hatch, h, w)
-            hatches = executor.submit(hatch, image_resized, draw_hatch).result()
-            lines += hatches * repeat_hatch
-    pure_filename = Path(image_filename).stem
+    if simplify:
+        for function in results:
+            results[function] = simplify_lines(results[function], simplify)
+
+    # overlaps are removed before the repeats, which are deliberate
+    if dedupe:
+        deduped = remove_overlaps(
+            [results[function] for function, options, repeat in branches], dedupe
+        )
+        results = {
+            function: lines
+            for (function, options, repeat), lines in zip(branches, deduped)
+        }
 
-    with open(Path(SVG_FOLDER) / f"{pure_filename}.svg", "w") as f:
-        f.write(make_svg(lines))
+    lines = StrokeSet.concatenate(
+        results[function] * repeat for function, options, repeat in branches
+    )
+    check_cancelled(cancel)
+
+    if optimise_path:
+        key = (
+            "sort_lines",
+            image_key,
+            resolution,
+            edge_engine,
+            draw_contours,
+            repeat_contours,
+            draw_hatch,
+            repeat_hatch,
+            simplify,
+            dedupe,
+            two_opt_time,
+        )
+        sorted_lines = cache.get(key)
+        if sorted_lines is None:
+            sorted_lines = sort_lines(lines, two_opt_time)
+            cache.put(key, sorted_lines)
+        lines = sorted_lines
+        check_cancelled(cancel)
+
+    if cache.max_entries or cache.directory is not None:
+        print(f"Stage cache: {cache.stats()}")
+
+    if write_svg:
+        pure_filename = Path(image_filename).stem
 
-    segments = sum(len(line) for line in lines)
-    print(f"{len(lines)} strokes, {segments} points. Done.")
+        os.makedirs(SVG_FOLDER, exist_ok=True)
+        check_cancelled(cancel)
+        svg_to_file(lines, Path(SVG_FOLDER) / f"{pure_filename}.svg", compact_svg)
+
+    print(f"{len(lines)} strokes, {len(lines.points)} points. Done.")
+    print(f"Estimate: {format_estimate(estimate_plot(lines))}")
     return lines
 
 
+class StageCache:
+    # Least-recently-used store for intermediate results of vectorise(),
+    # shared between calls (and threads) that convert the same image.
+    # Cached values are shared, so callers must not modify them.
+    #
+    # With a directory, results are also pickled to disk so that they survive
+    # between runs and can be shared by batch worker processes; the directory
+    # is kept under max_bytes by deleting the least recently used files.
+
+    version = 3  # bump when the type of any cached result changes
+
+    def __init__(self, max_entries=16, directory=None, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.directory = Path(directory) if directory is not None else None
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        digest = hashlib.sha256(repr((self.version, key)).encode()).hexdigest()
+        return self.directory / f"{digest}.pickle"
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        value = None
+        if self.directory is not None:
+            try:
+                with open(self.path(key), "rb") as cache_file:
+                    value = pickle.load(cache_file)
+                os.utime(self.path(key))
+            except (OSError, pickle.UnpicklingError, EOFError):
+                value = None
+
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self.remember(key, value)
+        return value
+
+    def put(self, key, value):
+        self.remember(key, value)
+        if self.directory is None:
+            return
+
+        # write to a temporary file first, so a reader never sees half a file
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(key)
+        temp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temp_path, "wb") as cache_file:
+            pickle.dump(value, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def remember(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def evict(self):
+        files = []
+        for path in self.directory.glob("*.pickle"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            total -= size
+
+    def stats(self):
+        return f"{self.hits} hits, {self.misses} misses"
+
+
+_file_hashes = {}
+
+
+def file_hash(path):
+    # content hash of an image file, remembered for as long as the file is
+    # unchanged so that repeat conversions don't read it again
+    stat = Path(path).stat()
+    key = (str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size)
+    if key not in _file_hashes:
+        with open(path, "rb") as image_file:
+            _file_hashes[key] = hashlib.file_digest(image_file, "sha256").hexdigest()
+    return _file_hashes[key]
+
+
 # -------------- vectorisation options --------------
 
 
-def get_contours(image, draw_contours=2):
+def get_contours(image, draw_contours=2, decimate=8):
     print("Generating contours...")
     image = find_edges(image)
     IM1 = np.array(image)
@@ -206,32 +630,52 @@ def get_contours(image, draw_contours=2):
         contours2[i] = [(c[1], c[0]) for c in contours2[i]]
     contours = contours1 + contours2
 
-    for i in range(len(contours)):
-        for j in range(len(contours)):
-            if len(contours[i]) > 0 and len(contours[j]) > 0:
-                if distance_sum(contours[j][0], contours[i][-1]) < 8:
-                    contours[i] = contours[i] + contours[j]
-                    contours[j] = []
+    contours = StrokeSet.from_lines(join_contours(contours, 8))
 
-    for i in range(len(contours)):
-        contours[i] = [contours[i][j] for j in range(0, len(contours[i]), 8)]
+    # keep every nth point of each contour
+    lengths = contours.lengths
+    step = np.arange(len(contours.points)) - np.repeat(contours.offsets[:-1], lengths)
+    offsets = np.concatenate(([0], np.cumsum((lengths + decimate - 1) // decimate)))
+    contours = StrokeSet(contours.points[step % decimate == 0], offsets)
 
-    contours = [c for c in contours if len(c) > 1]
-
-    for i in range(len(contours)):
-        contours[i] = [
-            (v[0] * draw_contours, v[1] * draw_contours) for v in contours[i]
-        ]
+    contours = contours[contours.lengths > 1]
+    contours.points *= draw_contours
 
     return contours
 
 
 # hatching
-def hatch(image, draw_hatch=16):
+def hatch(image, draw_hatch=16, engine=None):
 
     t0 = time.time()
+    engine = engine or HATCH_ENGINE
+
+    print(f"Hatching using hatch() ({engine})...")
+    if engine == "numpy":
+        lines, segments = hatch_lines_numpy(image, draw_hatch)
+    elif engine == "python":
+        horizontal_lines, diagonal_lines = hatch_segments_python(image, draw_hatch)
+        segments = len(horizontal_lines) + len(diagonal_lines)
+
+        # Make runs of touching segments into single lines; each group only
+        # holds segments running in one direction, so they are collinear
+        lines = StrokeSet.from_lines(
+            join_segments(horizontal_lines) + join_segments(diagonal_lines)
+        )
+    else:
+        raise ValueError(f"Unknown hatch engine: {engine}")
+
+    t1 = time.time()
+
+    print(f"Joined {segments} hatch segments into {len(lines)} strokes")
+    print(f"Hatching: {t1 - t0}")
+
+    return lines
+
 
-    print("Hatching using hatch()...")
+def hatch_segments_python(image, draw_hatch=16):
+    # the original per-pixel loop, kept so the numpy engine can be checked
+    # against it
     pixels = image.load()
     w, h = image.size
     horizontal_lines = []
@@ -273,39 +717,78 @@ def hatch(image, draw_hatch=16):
                     [(x + draw_hatch, y), (x, y + draw_hatch)]
                 )  # diagonal lines, left
 
-    t1 = time.time()
-
-    print("Wrangling points...")
-
-    # Make segments into lines
-    line_groups = [horizontal_lines, diagonal_lines]
-
-    for line_group in line_groups:
-        line_group = [
-            [
-                (
-                    line1 + line2[1:]
-                    if line1 and line2 and line1[-1] == line2[0]
-                    else line1
-                )
-                for line1, line2 in zip(line_group, line_group[1:])
-            ]
-            for _ in range(len(line_group))
-        ]
-
-        # in each line group keep any non-empty lines
-        saved_lines = [[line[0], line[-1]] for line in line_group if line]
-        line_group.clear()
-        line_group.extend(saved_lines)
-
-    lines = [item for group in line_groups for item in group]
-
-    t2 = time.time()
-
-    print(f"Hatching: {t1 - t0}")
-    print(f"Wrangling: {t2 - t1}")
-    print(f"Total: {t2 - t0}")
+    return horizontal_lines, diagonal_lines
+
+
+def hatch_lines_numpy(image, draw_hatch=16):
+    # Threshold the whole image into the 144/64/16 brightness bands at once,
+    # and turn each run of neighbouring pixels in a band into one line. The
+    # lines come out in the same order as joining the per-pixel segments of
+    # hatch_segments_python() would give.
+    pixels = np.asarray(image)
+
+    # every pixel at or below 144 gets a horizontal line, and pixels at or
+    # below 16 get a second one, offset by half the hatch spacing
+    rows1, starts1, stops1 = find_runs(pixels <= 144)
+    rows2, starts2, stops2 = find_runs(pixels <= 16)
+    rows = np.concatenate((rows1, rows2))
+    starts = np.concatenate((starts1, starts2))
+    stops = np.concatenate((stops1, stops2))
+    y = np.concatenate(
+        (
+            rows1 * draw_hatch + draw_hatch / 4,
+            rows2 * draw_hatch + draw_hatch / 2 + draw_hatch / 4,
+        )
+    )
+    second = np.arange(len(rows)) >= len(rows1)
+    order = np.lexsort((second, rows, starts))
+    horizontal_lines = StrokeSet.from_segments(
+        np.column_stack((starts * draw_hatch, y)),
+        np.column_stack(((stops - 1) * draw_hatch + draw_hatch, y)),
+    )[order]
+
+    # pixels at or below 64 get a diagonal line; skew the mask so that each
+    # anti-diagonal becomes a row
+    ys, xs = np.nonzero(pixels <= 64)
+    skewed = np.zeros((sum(pixels.shape) - 1, pixels.shape[0]), dtype=bool)
+    skewed[xs + ys, ys] = True
+    diagonals, starts, stops = find_runs(skewed)
+
+    # each line runs from the top right of its first pixel to the bottom left
+    # of its last
+    first_x, first_y = diagonals - starts, starts
+    last_x, last_y = diagonals - stops + 1, stops - 1
+    order = np.lexsort((first_y, first_x))
+    diagonal_lines = StrokeSet.from_segments(
+        np.column_stack((first_x * draw_hatch + draw_hatch, first_y * draw_hatch)),
+        np.column_stack((last_x * draw_hatch, last_y * draw_hatch + draw_hatch)),
+    )[order]
+
+    segments = np.count_nonzero(pixels <= 144) + np.count_nonzero(pixels <= 16)
+    segments += len(xs)
+    return horizontal_lines + diagonal_lines, segments
+
+
+def join_segments(segments):
+    # index every segment by its start point, then walk each run from its
+    # first segment, so every segment is visited once
+    starts = {segment[0]: i for i, segment in enumerate(segments)}
+    ends = {segment[-1] for segment in segments}
+    used = [False] * len(segments)
+    lines = []
 
+    for i, segment in enumerate(segments):
+        if used[i] or segment[0] in ends:
+            continue
+        used[i] = True
+        end = segment[-1]
+        while end in starts and not used[starts[end]]:
+            used[starts[end]] = True
+            end = segments[starts[end]][-1]
+        lines.append([segment[0], end])
+
+    # anything left over is part of a closed loop, which hatching never makes
+    lines += [segment for i, segment in enumerate(segments) if not used[i]]
     return lines
 
 
@@ -314,7 +797,7 @@ def hatch(image, draw_hatch=16):
 
 def find_edges(image):
     print("Finding edges...")
-    if NO_CV_MODE:
+    if not use_opencv():
         apply_mask(image, [F_SOBEL_X, F_SOBEL_Y])
     else:
         im = np.array(image)
@@ -327,77 +810,504 @@ def find_edges(image):
 def get_dots(image):
     print("Getting contour points...")
     h, w = image.shape
-    dots = []
-
-    for y in range(h - 1):
-        row = []
-        for x in range(1, w):
-            if image[y, x] == 255:
-                if row and x - row[-1][0] == row[-1][1] + 1:
-                    row[-1] = (row[-1][0], row[-1][1] + 1)
-                else:
-                    row.append((x, 0))
-        dots.append(row)
-    return dots
+
+    # run-length encode the edge pixels of each row, skipping the last row and
+    # the first column as before; each run is (x, number of pixels after the
+    # first)
+    rows, starts, stops = find_runs(image[: h - 1, 1:] == 255)
+    runs = list(zip((starts + 1).tolist(), (stops - starts - 1).tolist()))
+    bounds = np.searchsorted(rows, np.arange(h)).tolist()
+    return [runs[bounds[y] : bounds[y + 1]] for y in range(h - 1)]
 
 
 def connect_dots(dots):
     print("Connecting contour points...")
     contours = []
+    previous_xs = []
+    tails = {}  # x in the previous row -> contour ending there
+
     for y, row in enumerate(dots):
+        row_tails = {}
         for x, v in row:
             if v > -1:
-                if y == 0:
-                    contours.append([(x, y)])
+                # the closest run in the previous row, preferring the left one
+                # on a tie
+                i = bisect_left(previous_xs, x)
+                if i == len(previous_xs) or (
+                    i > 0 and x - previous_xs[i - 1] <= previous_xs[i] - x
+                ):
+                    i -= 1
+
+                contour = None
+                if i >= 0 and abs(previous_xs[i] - x) <= 3:
+                    contour = tails.pop(previous_xs[i], None)
+
+                if contour is None:
+                    contour = [(x, y)]
+                    contours.append(contour)
                 else:
-                    closest, closest_dist = min(
-                        ((x0, v0) for x0, v0 in dots[y - 1]),
-                        key=lambda point: abs(point[0] - x),
-                        default=(None, None),
-                    )
-                    if closest is None or abs(closest - x) > 3:
-                        contours.append([(x, y)])
-                    else:
-                        for contour in contours:
-                            if contour[-1] == (closest, y - 1):
-                                contour.append((x, y))
-                                break
-                        else:
-                            contours.append([(x, y)])
+                    contour.append((x, y))
+                row_tails[x] = contour
+
+        previous_xs = [x for x, v in row]
+        tails = row_tails
     return contours
 
 
+def join_contours(contours, threshold=8):
+    # Append to each contour, in order, any later-numbered contour starting
+    # within threshold of its current end. This gives the same result as
+    # checking every pair in turn (including a contour against itself, which
+    # drops it), but only looks at starts in the grid cells around each end.
+    def cell(point):
+        return int(point[0] // threshold), int(point[1] // threshold)
+
+    grid = {}
+    for j, contour in enumerate(contours):
+        if contour:
+            grid.setdefault(cell(contour[0]), []).append(j)
+
+    def next_join(end, first):
+        cx, cy = cell(end)
+        best = None
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                candidates = grid.get((cx + dx, cy + dy), [])
+                for j in candidates[bisect_left(candidates, first) :]:
+                    if best is not None and j >= best:
+                        break
+                    if distance_sum(contours[j][0], end) < threshold:
+                        best = j
+                        break
+        return best
+
+    contours = list(contours)
+    for i in range(len(contours)):
+        j = 0
+        while contours[i]:
+            j = next_join(contours[i][-1], j)
+            if j is None:
+                break
+            start_cell = grid[cell(contours[j][0])]
+            start_cell.pop(bisect_left(start_cell, j))
+            if j != i:
+                contours[i] = contours[i] + contours[j]
+            contours[j] = []
+            j += 1
+
+    return contours
+
+
+# -------------- simplification --------------
+
+
+def simplify_lines(lines, tolerance):
+    # Ramer-Douglas-Peucker on every stroke at once. Each pass looks at the
+    # spans between the points kept so far, and keeps the point of each span
+    # furthest from the straight line across it if that is more than
+    # tolerance away, splitting the span in two.
+    lines = StrokeSet.from_lines(lines)
+    points = lines.points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[lines.offsets[:-1]] = True
+    keep[lines.offsets[1:] - 1] = True
+    first = lines.offsets[:-1]
+    last = lines.offsets[1:] - 1
+
+    while len(first):
+        spans = last - first > 1
+        first, last = first[spans], last[spans]
+        counts = last - first - 1
+        span_starts = np.cumsum(counts) - counts
+        span = np.repeat(np.arange(len(first)), counts)
+        index = np.arange(counts.sum()) - span_starts[span] + first[span] + 1
+
+        a = points[first][span]
+        chord = points[last][span] - a
+        offset = points[index] - a
+        length = np.hypot(chord[:, 0], chord[:, 1])
+        cross = np.abs(chord[:, 0] * offset[:, 1] - chord[:, 1] * offset[:, 0])
+        distance = np.where(
+            length > 0,
+            cross / np.maximum(length, 1e-12),
+            np.hypot(offset[:, 0], offset[:, 1]),  # a closed loop
+        )
+
+        furthest = np.lexsort((-distance, span))[span_starts]
+        split = distance[furthest] > tolerance
+        middle = index[furthest[split]]
+        keep[middle] = True
+        first = np.concatenate((first[split], middle))
+        last = np.concatenate((middle, last[split]))
+
+    kept = np.concatenate(([0], np.cumsum(keep)))
+    simplified = StrokeSet(lines.points[keep], kept[lines.offsets])
+    print(
+        f"Simplified {len(lines)} strokes from {len(lines.points)} "
+        f"to {len(simplified.points)} points"
+    )
+    return simplified
+
+
+def remove_overlaps(groups, tolerance):
+    # Drops the parts of strokes that retrace earlier ones. groups is a list
+    # of StrokeSets (e.g. the contours, then the hatching), taken in order;
+    # a trimmed StrokeSet is returned for each. Strokes are sampled every
+    # half tolerance, and the samples looked up in a spatial hash: a grid of
+    # cells that size, in which the samples of every earlier stroke have
+    # marked their own cell and its neighbours with their direction (to
+    # within 1/16 turn, so that lines which only cross don't count). A
+    # stroke with all its samples marked is dropped, and one that starts or
+    # ends with marked samples is cut back to the first and last unmarked
+    # ones (plus a sample, to meet the earlier line).
+    groups = [StrokeSet.from_lines(lines) for lines in groups]
+    every = StrokeSet.concatenate(groups)
+    if not len(every.points):
+        return groups
+    low = every.points.min(axis=0)
+    extent = every.points.max(axis=0) - low
+    cell = max(tolerance / 2, float(extent.max()) / 4096)
+    width, height = (int(v) + 3 for v in np.ceil(extent / cell))
+    grid = np.zeros(width * height, dtype=np.uint16)
+    neighbours = (np.arange(-1, 2)[:, None] + np.arange(-1, 2) * width).ravel()
+
+    length_before = length_after = 0.0
+    trimmed_groups = []
+    for lines in groups:
+        trimmed = []
+        for stroke in lines:
+            a, b = stroke[:-1], stroke[1:]
+            lengths = np.hypot(*(b - a).T)
+            angles = np.arctan2(*(b - a).T[::-1]) % np.pi
+            directions = (angles * 16 / np.pi).astype(np.int64) % 16
+            bits = (1 << directions).astype(np.uint16)
+            nearby = bits | (1 << (directions + 1) % 16) | (1 << (directions - 1) % 16)
+            length_before += lengths.sum()
+
+            counts = np.ceil(lengths / cell).astype(np.int64) + 1
+            firsts = np.cumsum(counts) - counts
+            segment = np.repeat(np.arange(len(a)), counts)
+            step = np.arange(counts.sum()) - firsts[segment]
+            t = step / np.maximum(counts - 1, 1)[segment]
+            samples = a[segment] + (b - a)[segment] * t[:, None]
+            x, y = ((samples - low) / cell).T.astype(np.int64) + 1
+            cells = x + y * width
+            marked = (grid[cells] & bits[segment]) != 0
+            np.bitwise_or.at(
+                grid,
+                (cells[:, None] + neighbours).ravel(),
+                np.repeat(nearby[segment].astype(np.uint16), len(neighbours)),
+            )
+
+            if not marked.any():
+                trimmed.append(stroke)
+                length_after += lengths.sum()
+                continue
+            if marked.all():
+                continue
+
+            # only the ends are trimmed: cutting a stroke in the middle would
+            # cost a pen lift, and the pen has to cross the gap anyway
+            unmarked = np.flatnonzero(~marked)
+            first = max(unmarked[0] - 1, 0)
+            last = min(unmarked[-1] + 1, len(samples) - 1)
+            vertices = np.append(firsts, len(samples) - 1)
+            inside = (vertices > first) & (vertices < last)
+            points = np.vstack([samples[first], stroke[inside], samples[last]])
+            points = points[np.r_[True, (points[1:] != points[:-1]).any(axis=1)]]
+            trimmed.append(points)
+            length_after += np.hypot(*np.diff(points, axis=0).T).sum()
+        trimmed_groups.append(StrokeSet.from_lines(trimmed))
+
+    saved = length_before - length_after
+    print(
+        f"Removed {saved:.0f} of {length_before:.0f} units of retraced line "
+        f"({100 * saved / max(length_before, 1e-9):.1f}%)"
+    )
+    return trimmed_groups
+
+
 # -------------- optimisation for pen movement --------------
 
 
-def sort_lines(lines):
+def sort_lines(lines, two_opt_time=0):
     print("Optimizing stroke sequence...")
-    sorted_lines = [lines.pop(0)]
-    while lines:
-        last_point = sorted_lines[-1][-1]
-        closest_line = min(
-            lines,
-            key=lambda line: min(
-                distance_sum(line[0], last_point), distance_sum(line[-1], last_point)
-            ),
+    lines = StrokeSet.from_lines(lines)
+    if not len(lines):
+        return lines
+    travel_before = pen_up_distance(lines)
+    starts = lines.starts.tolist()
+    ends = lines.ends.tolist()
+
+    # Put both ends of every line in a k-d tree: boxes split in half at the
+    # median along their longer side, down to a few points each. Each box
+    # counts the ends still in it, so used-up parts of the drawing are
+    # skipped, and however the lines are spread out the search only looks
+    # at the boxes around the pen.
+    count = len(lines)
+    points = np.concatenate([lines.starts, lines.ends])
+    lows, highs, parents, children, items, counts = [], [], [], [], [], []
+    leaf_of = [0] * (2 * count)
+
+    def build(indices, parent):
+        node = len(counts)
+        lows.append(points[indices].min(axis=0).tolist())
+        highs.append(points[indices].max(axis=0).tolist())
+        parents.append(parent)
+        counts.append(len(indices))
+        if len(indices) <= 8:
+            children.append(None)
+            items.append(indices.tolist())
+            for k in items[node]:
+                leaf_of[k] = node
+        else:
+            children.append(())
+            items.append(None)
+            axis = int(np.argmax(np.subtract(highs[node], lows[node])))
+            half = len(indices) // 2
+            split = np.argpartition(points[indices, axis], half)
+            children[node] = (
+                build(indices[split[:half]], node),
+                build(indices[split[half:]], node),
+            )
+        return node
+
+    build(np.arange(2 * count), -1)
+
+    def remove(i):
+        for k in (i, i + count):
+            node = leaf_of[k]
+            items[node].remove(k)
+            while node >= 0:
+                counts[node] -= 1
+                node = parents[node]
+
+    def closest(point):
+        px, py = point
+        best, best_distance, reverse = None, math.inf, False
+
+        def gap(node):
+            (lx, ly), (hx, hy) = lows[node], highs[node]
+            return math.hypot(max(lx - px, 0, px - hx), max(ly - py, 0, py - hy))
+
+        def search(node, node_gap):
+            nonlocal best, best_distance, reverse
+            # boxes as far away as the best line so far are still searched, to
+            # break ties by line number as before
+            if not counts[node] or node_gap > best_distance:
+                return
+            if children[node] is None:
+                for k in items[node]:
+                    i = k % count
+                    start = distance_sum(starts[i], point)
+                    end = distance_sum(ends[i], point)
+                    if min(start, end) < best_distance or (
+                        min(start, end) == best_distance and i < best
+                    ):
+                        best, best_distance = i, min(start, end)
+                        reverse = start > end
+                return
+            near, far = children[node]
+            near_gap, far_gap = gap(near), gap(far)
+            if far_gap < near_gap:
+                near, far, near_gap, far_gap = far, near, far_gap, near_gap
+            search(near, near_gap)
+            search(far, far_gap)
+
+        search(0, gap(0))
+        return best, reverse
+
+    remove(0)
+    order, reversed_lines = [0], [False]
+    pen = ends[0]
+    for _ in range(len(lines) - 1):
+        i, reverse = closest(pen)
+        remove(i)
+        order.append(i)
+        reversed_lines.append(reverse)
+        pen = starts[i] if reverse else ends[i]
+
+    if two_opt_time:
+        order, reversed_lines = two_opt(
+            order, reversed_lines, starts, ends, two_opt_time
         )
-        if distance_sum(closest_line[0], last_point) > distance_sum(
-            closest_line[-1], last_point
-        ):
-            closest_line.reverse()
-        sorted_lines.append(closest_line)
-        lines.remove(closest_line)
+    sorted_lines = lines.take(order, reversed_lines)
+
+    print(
+        f"Pen-up travel: {travel_before:.0f} before, "
+        f"{pen_up_distance(sorted_lines):.0f} after"
+    )
     return sorted_lines
 
 
-def lines_to_file(lines, filename):
-    with open(filename, "w") as file_to_save:
-        json.dump(lines, file_to_save, indent=4)
+def two_opt(order, reversed_lines, starts, ends, time_limit, window=50):
+    # Reverse runs of up to `window` consecutive lines (flipping each line in
+    # the run too) wherever that shortens the pen-up moves at either end of
+    # the run, until nothing improves or time runs out. The first line stays
+    # where it is. Lines are given by their index into starts and ends and
+    # whether they are drawn reversed.
+    deadline = time.monotonic() + time_limit
+    order = list(order)
+    reversed_lines = list(reversed_lines)
+
+    def first(k):
+        return ends[order[k]] if reversed_lines[k] else starts[order[k]]
+
+    def last(k):
+        return starts[order[k]] if reversed_lines[k] else ends[order[k]]
+
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for i in range(1, len(order)):
+            if time.monotonic() > deadline:
+                break
+            before = last(i - 1)
+            for j in range(i, min(i + window, len(order))):
+                old = distance_sum(before, first(i))
+                new = distance_sum(before, last(j))
+                if j + 1 < len(order):
+                    after = first(j + 1)
+                    old += distance_sum(last(j), after)
+                    new += distance_sum(first(i), after)
+                if new < old - 1e-9:
+                    order[i : j + 1] = order[i : j + 1][::-1]
+                    reversed_lines[i : j + 1] = [
+                        not reverse for reverse in reversed_lines[i : j + 1][::-1]
+                    ]
+                    improved = True
+    return order, reversed_lines
+
+
+def pen_up_distance(lines):
+    lines = StrokeSet.from_lines(lines)
+    moves = lines.starts[1:] - lines.ends[:-1]
+    return float(np.hypot(moves[:, 0], moves[:, 1]).sum())
+
+
+# -------------- plot estimates --------------
+
+
+def estimate_plot(
+    lines, bounds=PLOT_BOUNDS, speed=PLOT_SPEED, pen_lift=PEN_LIFT_SECONDS
+):
+    # Stroke count, pen-down and pen-up distances (in cm, with the drawing
+    # scaled to fit bounds as BrachioGraph's plot_file() does) and plotting
+    # time in seconds, moving at speed cm/s and taking pen_lift seconds each
+    # time the pen goes down or up.
+    lines = StrokeSet.from_lines(lines)
+    estimate = {"strokes": len(lines), "pen_down": 0.0, "pen_up": 0.0, "seconds": 0.0}
+    if not len(lines):
+        return estimate
+
+    points = lines.points
+    size = points.max(axis=0) - points.min(axis=0)
+    area = np.array([bounds[2] - bounds[0], bounds[3] - bounds[1]], dtype=np.float64)
+    scale = (area / np.where(size > 0, size, np.inf)).min()
+    if not np.isfinite(scale):
+        scale = 1.0  # a single point
+
+    moves = np.diff(points, axis=0)
+    lengths = np.hypot(moves[:, 0], moves[:, 1]) * scale
+    # the moves from the end of one stroke to the start of the next
+    pen_up = np.zeros(len(lengths), dtype=bool)
+    pen_up[lines.offsets[1:-1] - 1] = True
+
+    estimate["pen_down"] = float(lengths[~pen_up].sum())
+    estimate["pen_up"] = float(lengths[pen_up].sum())
+    estimate["seconds"] = (
+        estimate["pen_down"] + estimate["pen_up"]
+    ) / speed + 2 * pen_lift * len(lines)
+    return estimate
+
+
+def format_estimate(estimate):
+    minutes, seconds = divmod(round(estimate["seconds"]), 60)
+    hours, minutes = divmod(minutes, 60)
+    duration = f"{hours}h {minutes:02d}m" if hours else f"{minutes}m {seconds:02d}s"
+    return (
+        f"{estimate['strokes']} strokes, {estimate['pen_down'] / 100:.1f} m pen down, "
+        f"{estimate['pen_up'] / 100:.1f} m pen up, about {duration} to plot"
+    )
+
+
+def lines_to_file(lines, filename, precision=None):
+    # With no precision this writes the original indented JSON. Otherwise
+    # coordinates are rounded to that many decimal places (whole numbers for
+    # 0) and written compactly one stroke at a time. A filename ending in .gz
+    # is gzipped.
+    lines = StrokeSet.from_lines(lines)
+    if str(filename).endswith(".gz"):
+        file_to_save = gzip.open(filename, "wt", compresslevel=6)
+    else:
+        file_to_save = open(filename, "w")
+    with file_to_save:
+        if precision is None:
+            json.dump(lines.tolist(), file_to_save, indent=4)
+            return
+        file_to_save.write("[")
+        for i, line in enumerate(lines):
+            if i:
+                file_to_save.write(",\n")
+            line = plain_numbers(line.round(precision))
+            file_to_save.write(json.dumps(line, separators=(",", ":")))
+        file_to_save.write("]\n")
 
 
 # -------------- helper functions --------------
 
 
+def use_opencv():
+    # OpenCV is slow to import, so it is only loaded when first needed
+    global cv2, NO_CV_MODE
+    if not NO_CV_MODE and cv2 is None:
+        try:
+            import cv2
+        except ImportError as import_error:
+            print(f"ImportError: {import_error}")
+            print("Unable to import openCV. Switching to NO_CV mode.")
+            NO_CV_MODE = True
+    return not NO_CV_MODE
+
+
+def branch_executor(workers):
+    # the process pool for vectorise(workers=workers), started on first use
+    # and kept for later calls
+    if workers not in branch_pools:
+        branch_pools[workers] = ProcessPoolExecutor(max_workers=workers)
+    return branch_pools[workers]
+
+
+class Cancelled(Exception):
+    pass
+
+
+def check_cancelled(cancel):
+    # cancel is anything with an is_set() method, such as a threading.Event
+    if cancel is not None and cancel.is_set():
+        raise Cancelled("Conversion cancelled")
+
+
+def find_runs(mask):
+    # rows, starts and (exclusive) stops of the runs of True along each row of
+    # a 2D mask; a padded diff marks run starts with 1 and their stops with -1
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    changes = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(changes == 1)
+    stops = np.nonzero(changes == -1)[1]
+    return rows, starts, stops
+
+
+def plain_numbers(points):
+    # an (n, 2) array as a list of [x, y] lists, with whole numbers as ints
+    # so that they are written as 1022 rather than 1022.0
+    return [
+        [int(x) if x.is_integer() else x, int(y) if y.is_integer() else y]
+        for x, y in points.tolist()
+    ]
+
+
 def mid_point(*args):
     xs, ys = 0, 0
     for p in args:
@@ -417,22 +1327,28 @@ def distance_sum(*points):
 
 
 def apply_mask(IM, masks):
-    px = IM.load()
-    w, h = IM.size
-    npx = {}
-    for x in range(0, w):
-        for y in range(0, h):
-            a = [0] * len(masks)
-            for i in range(len(masks)):
-                for p in masks[i].keys():
-                    if 0 < x + p[0] < w and 0 < y + p[1] < h:
-                        a[i] += px[x + p[0], y + p[1]] * masks[i][p]
-                if sum(masks[i].values()) != 0:
-                    a[i] = a[i] / sum(masks[i].values())
-            npx[x, y] = int(sum([v**2 for v in a]) ** 0.5)
-    for x in range(0, w):
-        for y in range(0, h):
-            px[x, y] = npx[x, y]
+    # Convolve the image with each mask and replace every pixel with the
+    # magnitude of the results, e.g. Sobel X and Y give the gradient size.
+    # Neighbours outside the image, or in its first row or column, count as
+    # zero, and masks that don't sum to zero are normalised.
+    px = np.asarray(IM, dtype=np.float64)
+    h, w = px.shape
+    r = max(max(abs(dx), abs(dy)) for mask in masks for dx, dy in mask)
+    padded = np.zeros((h + 2 * r, w + 2 * r))
+    padded[r + 1 : r + h, r + 1 : r + w] = px[1:, 1:]
+
+    magnitude = np.zeros((h, w))
+    for mask in masks:
+        a = np.zeros((h, w))
+        for (dx, dy), weight in mask.items():
+            if weight:
+                a += weight * padded[r + dy : r + dy + h, r + dx : r + dx + w]
+        if sum(mask.values()) != 0:
+            a /= sum(mask.values())
+        magnitude += a**2
+
+    magnitude = np.sqrt(magnitude).astype(np.int64).clip(0, 255)
+    IM.paste(Image.fromarray(magnitude.astype(np.uint8)))
 
 
 # Constants for masking
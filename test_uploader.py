@@ -0,0 +1,177 @@
+# Checks UploadManager against a paramiko SFTP server running in this
+# process, connected through a socket pair by the open_transport hook.
+#
+#   uv run --with paramiko python -m unittest test_uploader
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+import paramiko
+
+from uploader import UploadManager
+
+HOST_KEY = paramiko.RSAKey.generate(1024)
+PASSWORD = "secret"
+
+
+class Server(paramiko.ServerInterface):
+    def check_auth_password(self, username, password):
+        if password == PASSWORD:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+
+class Handle(paramiko.SFTPHandle):
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+class FolderSFTP(paramiko.SFTPServerInterface):
+    # serves the folder in the server's root attribute
+    def local(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip("/"))
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.local(path)))
+        except OSError as error:
+            return paramiko.SFTPServer.convert_errno(error.errno)
+
+    lstat = stat
+
+    def list_folder(self, path):
+        folder = self.local(path)
+        listing = []
+        for name in os.listdir(folder):
+            attributes = paramiko.SFTPAttributes.from_stat(
+                os.stat(os.path.join(folder, name))
+            )
+            attributes.filename = name
+            listing.append(attributes)
+        return listing
+
+    def open(self, path, flags, attr):
+        try:
+            descriptor = os.open(self.local(path), flags, 0o644)
+        except OSError as error:
+            return paramiko.SFTPServer.convert_errno(error.errno)
+        if flags & os.O_RDWR:
+            mode = "r+b"
+        elif flags & os.O_WRONLY:
+            mode = "wb"
+        else:
+            mode = "rb"
+        handle = Handle(flags)
+        handle.readfile = handle.writefile = os.fdopen(descriptor, mode)
+        return handle
+
+    def chattr(self, path, attr):
+        paramiko.SFTPServer.set_file_attr(self.local(path), attr)
+        return paramiko.SFTP_OK
+
+
+class UploadManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.local = Path(tempfile.mkdtemp())
+        self.remote = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.local)
+        self.addCleanup(shutil.rmtree, self.remote)
+        (self.remote / "drawings").mkdir()
+        self.server_transports = []
+        self.manager = UploadManager(workers=2, open_transport=self.open_transport)
+        self.addCleanup(self.manager.close)
+
+    def open_transport(self, hostname, port):
+        client, server = socket.socketpair()
+        transport = paramiko.Transport(server)
+        transport.add_server_key(HOST_KEY)
+        handler = type("Root", (FolderSFTP,), {"root": str(self.remote)})
+        transport.set_subsystem_handler("sftp", paramiko.SFTPServer, handler)
+        transport.start_server(event=threading.Event(), server=Server())
+        self.server_transports.append(transport)
+        self.addCleanup(transport.close)
+        return paramiko.Transport(client)
+
+    def write(self, name, text, mtime=1_600_000_000):
+        path = self.local / name
+        path.write_text(text)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def upload(self, path, password=PASSWORD):
+        return self.manager.upload(
+            "plotter", "pi", password, path, f"drawings/{path.name}"
+        ).result(timeout=10)
+
+    def test_uploads_reuse_the_connection(self):
+        self.upload(self.write("a.json", "[[1, 2]]"))
+        self.upload(self.write("b.json", "[[3, 4]]"))
+        self.assertEqual(len(self.server_transports), 1)
+        self.assertEqual((self.remote / "drawings" / "b.json").read_text(), "[[3, 4]]")
+
+    def test_reconnects_after_the_connection_drops(self):
+        self.upload(self.write("a.json", "[[1, 2]]"))
+        self.server_transports[0].close()
+        self.upload(self.write("b.json", "[[3, 4]]"))
+        self.assertEqual(len(self.server_transports), 2)
+        self.assertTrue((self.remote / "drawings" / "b.json").exists())
+
+    def test_file_errors_leave_the_connection_alone(self):
+        self.upload(self.write("a.json", "[[1, 2]]"))
+        with self.assertRaises(FileNotFoundError):
+            self.manager.upload(
+                "plotter", "pi", PASSWORD, self.local / "a.json", "nope/a.json"
+            ).result(timeout=10)
+        with self.assertRaises(FileNotFoundError):
+            self.upload(self.local / "missing.json")
+        self.assertEqual(len(self.server_transports), 1)
+        self.assertTrue(self.server_transports[0].is_active())
+
+    def test_bad_password_fails_without_keeping_the_connection(self):
+        with self.assertRaises(paramiko.AuthenticationException):
+            self.upload(self.write("a.json", "[[1, 2]]"), password="wrong")
+        self.assertEqual(self.manager.transports, {})
+        self.upload(self.write("a.json", "[[1, 2]]"))
+
+    def test_sync_uploads_only_changed_files(self):
+        self.write("a.json", "[[1, 2]]")
+        self.write("b.json", "[[3, 4]]")
+        self.write("notes.txt", "not a drawing")
+        args = ("plotter", "pi", PASSWORD, self.local, "drawings")
+        self.assertEqual(
+            [path.name for path in self.manager.sync(*args)], ["a.json", "b.json"]
+        )
+        self.assertEqual(self.manager.changed_files(*args), [])
+
+        self.write("b.json", "[[3, 4], [5, 6]]", mtime=1_700_000_000)
+        self.assertEqual([path.name for path in self.manager.sync(*args)], ["b.json"])
+        self.assertEqual(
+            (self.remote / "drawings" / "b.json").read_text(), "[[3, 4], [5, 6]]"
+        )
+
+    def test_put_keeps_the_modification_time(self):
+        path = self.write("a.json", "[[1, 2]]")
+        self.manager.put(
+            "plotter",
+            "pi",
+            PASSWORD,
+            path,
+            "drawings/a.json",
+            preserve_mtime=True,
+        )
+        self.assertEqual(os.stat(self.remote / "drawings" / "a.json").st_mtime, 1.6e9)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+# Uploads files to BrachioGraph devices over SFTP, keeping one authenticated
+# connection per device open between uploads so that repeated uploads skip
+# the SSH handshake.
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+
+import paramiko
+
+KEEPALIVE_SECONDS = 30
+
+
+def open_transport(hostname, port):
+    return paramiko.Transport((hostname, port))
+
+
+class UploadManager:
+    # Transfers run on the manager's worker threads; upload() returns a
+    # concurrent.futures.Future. All the workers share the device's
+    # transport, each with its own SFTP channel on it. A connection that has
+    # dropped is reopened, and an upload that fails because the connection
+    # went away is retried once on a new one.
+    #
+    # open_transport(hostname, port) makes the unconnected paramiko
+    # Transport; pass another function to connect over something other than
+    # a TCP socket, e.g. to a local test server.
+
+    def __init__(
+        self, workers=1, keepalive=KEEPALIVE_SECONDS, open_transport=open_transport
+    ):
+        self.keepalive = keepalive
+        self.open_transport = open_transport
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="upload")
+        self.transports = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def transport(self, hostname, username, password, port=22):
+        key = (hostname, port, username, password)
+        with self.lock:
+            transport = self.transports.get(key)
+            if transport is None or not transport.is_active():
+                if transport is not None:
+                    print(f"Connection to {hostname} lost, reconnecting...")
+                    transport.close()
+                print(f"Connecting to {hostname}...")
+                transport = self.open_transport(hostname, port)
+                transport.set_keepalive(self.keepalive)
+                try:
+                    transport.connect(username=username, password=password)
+                except Exception:
+                    transport.close()
+                    raise
+                self.transports[key] = transport
+            return transport
+
+    def sftp(self, hostname, username, password, port=22):
+        # the calling thread's SFTP channel on the device's transport
+        transport = self.transport(hostname, username, password, port)
+        clients = self.local.__dict__.setdefault("clients", {})
+        client = clients.get(transport)
+        if client is None or client.get_channel().closed:
+            client = paramiko.SFTPClient.from_transport(transport)
+            clients.clear()  # channels on transports that have gone
+            clients[transport] = client
+        return client
+
+    def connected(self, hostname, username, password, port=22):
+        with self.lock:
+            transport = self.transports.get((hostname, port, username, password))
+        return transport is not None and transport.is_active()
+
+    def disconnect(self, hostname, username, password, port=22):
+        with self.lock:
+            transport = self.transports.pop((hostname, port, username, password), None)
+        if transport is not None:
+            transport.close()
+
+    def put(
+        self,
+        hostname,
+        username,
+        password,
+        local_path,
+        remote_path,
+        callback=None,
+        port=22,
+        preserve_mtime=False,
+    ):
+        # upload in the calling thread; callback(bytes_sent, total_bytes) is
+        # called as the transfer goes
+        for attempt in range(2):
+            try:
+                sftp = self.sftp(hostname, username, password, port)
+                attributes = sftp.put(
+                    str(local_path), str(remote_path), callback=callback
+                )
+                if preserve_mtime:
+                    stat = os.stat(local_path)
+                    sftp.utime(str(remote_path), (stat.st_atime, stat.st_mtime))
+                return attributes
+            except paramiko.AuthenticationException:
+                raise
+            except (EOFError, OSError, paramiko.SSHException) as error:
+                # SFTP status errors (e.g. a missing remote folder, no
+                # permission) and a missing local file are OSErrors too, but
+                # leave the connection working for the other workers
+                if attempt or (
+                    isinstance(error, OSError)
+                    and self.connected(hostname, username, password, port)
+                ):
+                    raise
+                self.disconnect(hostname, username, password, port)
+
+    def upload(self, *args, **kwargs):
+        # put() on a worker thread
+        return self.executor.submit(self.put, *args, **kwargs)
+
+    def changed_files(
+        self,
+        hostname,
+        username,
+        password,
+        local_folder,
+        remote_directory,
+        pattern="*.json",
+        port=22,
+    ):
+        # the files in local_folder matching pattern that are missing from
+        # remote_directory, or there with a different size or modification time
+        sftp = self.sftp(hostname, username, password, port)
+        remote = {
+            attributes.filename: attributes
+            for attributes in sftp.listdir_attr(str(remote_directory))
+        }
+        changed = []
+        for path in sorted(Path(local_folder).glob(pattern)):
+            stat = path.stat()
+            attributes = remote.get(path.name)
+            if (
+                attributes is None
+                or attributes.st_size != stat.st_size
+                or attributes.st_mtime != int(stat.st_mtime)
+            ):
+                changed.append(path)
+        return changed
+
+    def sync(
+        self,
+        hostname,
+        username,
+        password,
+        local_folder,
+        remote_directory,
+        pattern="*.json",
+        callback=None,
+        port=22,
+    ):
+        # Uploads the changed_files() on the worker threads, all at once over
+        # the one connection, and waits for them; uploaded files get the local
+        # modification time so they compare equal next time. callback gets
+        # the bytes sent and total for all the files together. Returns the
+        # paths uploaded. Don't call it from a worker thread.
+        changed = self.changed_files(
+            hostname, username, password, local_folder, remote_directory, pattern, port
+        )
+        print(f"Syncing {len(changed)} changed files to {hostname}")
+        total = sum(path.stat().st_size for path in changed)
+        sent = {}
+        lock = threading.Lock()
+
+        def progress(path):
+            def update(bytes_sent, file_size):
+                with lock:
+                    sent[path] = bytes_sent
+                    if callback is not None:
+                        callback(sum(sent.values()), total)
+
+            return update
+
+        futures = [
+            self.upload(
+                hostname,
+                username,
+                password,
+                path,
+                PurePosixPath(remote_directory) / path.name,
+                progress(path),
+                port,
+                preserve_mtime=True,
+            )
+            for path in changed
+        ]
+        for future in futures:
+            future.result()
+        return changed
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            transports = list(self.transports.values())
+            self.transports.clear()
+        for transport in transports:
+            transport.close()